@@ -1,46 +1,241 @@
+import functools
+import hashlib
+import html
+import os
+import pickle
+import re
 import tkinter as tk
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
 from tkinter import filedialog, messagebox, simpledialog
+import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
+from lxml import etree
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    try:
+        # selectolax < 1.0 only ships the modest backend
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None  # selectolax is optional; lxml is used instead
 
 # -----------------------------------------------------
 # 1) Helper Functions to Extract and Paginate Text
 # -----------------------------------------------------
+# ebooklib item type of HTML/xHTML chapters
+ITEM_DOCUMENT = ebooklib.ITEM_DOCUMENT
+# encoding="..." in a leading XML declaration
+XML_ENCODING_RE = re.compile(
+    rb'(?:\xef\xbb\xbf)?\s*<\?xml[^>]*?\bencoding\s*=\s*["\']([A-Za-z0-9._:-]+)["\']')
+# Any markup tag, doctype or XML declaration. Quoted attribute
+# values are matched whole, since they may legally contain '>'.
+TAG_RE = re.compile(rb'<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+# Constructs a plain tag strip can't handle: script/style bodies
+# must be dropped, and comments/CDATA may contain '>'.
+NEEDS_PARSER_RE = re.compile(rb'<(?:script|style)\b|<!--|<!\[CDATA\[', re.IGNORECASE)
+
+def _extract_text_regex(content):
+    """
+    Fast path for simple xHTML: strips tags with a regex
+    and unescapes entities. Returns None if the content
+    isn't UTF-8. A leading BOM is dropped.
+
+    >>> _extract_text_regex(b'\\xef\\xbb\\xbf<?xml version="1.0"?><p>Hello</p>').split()
+    ['Hello']
+    >>> _extract_text_regex(b'<p title="a > b">x</p>').split()
+    ['x']
+    """
+    try:
+        text = TAG_RE.sub(b' ', content).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return None
+    return html.unescape(text)
+
+def _detect_encoding(content):
+    """
+    Returns the encoding lxml should decode the content with,
+    or None to let it sniff one (BOM, <meta charset>).
+    lxml's HTML parser ignores the XML declaration, so the
+    declared encoding is read here; without one, XML's
+    UTF-8 default is used when the bytes are valid UTF-8.
+    """
+    match = XML_ENCODING_RE.match(content)
+    if match:
+        return match.group(1).decode('ascii')
+    try:
+        content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    return 'utf-8'
+
+def _extract_text_lxml(content):
+    """
+    Parses the content with lxml and returns its text,
+    leaving out <script> and <style> bodies.
+
+    >>> _extract_text_lxml(b'<?xml version="1.0" encoding="iso-8859-1"?>'
+    ...                    b'<html><body><p>caf\\xe9</p></body></html>') == 'caf\\xe9'
+    True
+    """
+    try:
+        parser = etree.HTMLParser(encoding=_detect_encoding(content))
+    except LookupError:
+        parser = etree.HTMLParser()  # Unknown declared encoding; let lxml sniff
+    root = etree.HTML(content, parser)
+    if root is None:
+        return ''  # Empty document
+    etree.strip_elements(root, 'script', 'style', with_tail=False)
+    return ' '.join(root.itertext())
+
+def _extract_text_selectolax(content):
+    """
+    Parses the content with selectolax and returns its text,
+    leaving out <script> and <style> bodies. Returns None if
+    the content isn't UTF-8, which selectolax can't detect.
+    A leading BOM is dropped, as lxml does.
+    """
+    try:
+        markup = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return None
+    tree = SelectolaxParser(markup)
+    tree.strip_tags(['script', 'style'])
+    return tree.text(separator=' ')
+
+def _extract_chapter_text(content):
+    """
+    Returns the text of one HTML/xHTML chapter, using the
+    regex fast path unless the markup needs a real parser.
+    selectolax is preferred over lxml when it's installed.
+    """
+    text = None
+    if not NEEDS_PARSER_RE.search(content):
+        text = _extract_text_regex(content)
+    elif SelectolaxParser is not None:
+        text = _extract_text_selectolax(content)
+    if text is not None:
+        return text
+    return _extract_text_lxml(content)
+
+def iter_chapter_texts(epub_file_path):
+    """
+    Yields the text of each HTML/xHTML chapter
+    of an ePub file, in the order they appear in the ePub.
+    """
+    book = epub.read_epub(epub_file_path)
+    # Only HTML/xHTML items hold chapter text
+    contents = [item.content for item in book.get_items_of_type(ITEM_DOCUMENT)]
+
+    # Chapters that need a parser release the GIL while parsing (lxml,
+    # and selectolax's lexbor backend), so they overlap on a thread pool;
+    # regex fast-path chapters hold it and gain little. map() keeps
+    # them in their original order.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        # No cleaning needed: str.split() later handles all whitespace.
+        yield from executor.map(_extract_chapter_text, contents)
+
 def extract_text_from_epub(epub_file_path):
     """
     Extracts all textual content from an ePub file,
-    returning a list of words.
+    returning (full_text, offsets): the words joined by
+    single spaces, and an array of where each word starts.
+    offsets has one extra trailing entry, one past the end
+    of the text, so words i..j-1 are
+    full_text[offsets[i] : offsets[j] - 1].
+    The chapters are joined first so the whole book
+    is split in a single str.split() call.
     """
-    book = epub.read_epub(epub_file_path)
-    all_words = []
+    words = ' '.join(iter_chapter_texts(epub_file_path)).split()
+    full_text = ' '.join(words)
+    offsets = array('I', [0])
+    offsets.extend(accumulate(len(word) + 1 for word in words))
+    return full_text, offsets
 
-    for item in book.get_items():
-        # Check if this item is HTML/xHTML content
-        if item.get_type() == epub.ITEM_DOCUMENT:
-            soup = BeautifulSoup(item.content, 'html.parser')
-            text_content = soup.get_text(separator=' ')
-            
-            # Quick cleaning
-            text_content = text_content.replace('\n', ' ').strip()
-            words_in_chapter = text_content.split()
-            all_words.extend(words_in_chapter)
+# Where extracted texts are cached between runs. Bump
+# CACHE_VERSION whenever the extraction output changes.
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'epub_sim')
+CACHE_VERSION = 6
+# Length of the checksum stored at the start of each cache entry
+CACHE_DIGEST_SIZE = hashlib.blake2b().digest_size
+
+def load_text_cached(epub_file_path):
+    """
+    Same as extract_text_from_epub, but caches the result on
+    disk keyed by the file's path, mtime and size (and which
+    parser backend is installed, since their output differs
+    slightly), so reopening an unchanged ePub skips parsing entirely.
+    Caching is best-effort; any cache error falls back to parsing.
+    """
+    stat = os.stat(epub_file_path)
+    key = hashlib.blake2b(
+        f"{CACHE_VERSION}{SelectolaxParser is not None}"
+        f"{os.path.abspath(epub_file_path)}"
+        f"{stat.st_mtime_ns}{stat.st_size}".encode()
+    ).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, f"{key}.pkl")
 
-    return all_words
+    # Entries are a blake2b digest followed by the pickle, so a damaged
+    # file is detected before it is unpickled.
+    cached = None
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        digest, payload = data[:CACHE_DIGEST_SIZE], data[CACHE_DIGEST_SIZE:]
+        if hashlib.blake2b(payload).digest() == digest:
+            cached = pickle.loads(payload)
+    except Exception:
+        # Cache miss, or an entry unpickling chokes on (which can raise
+        # almost anything); parsing below overwrites it.
+        cached = None
+    if (isinstance(cached, tuple) and len(cached) == 2
+            and isinstance(cached[0], str) and isinstance(cached[1], array)):
+        return cached
+
+    result = extract_text_from_epub(epub_file_path)
+
+    # Write to a temp file first so an interrupted write never
+    # replaces a good entry; the checksum catches anything else.
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(tmp_path, 'wb') as f:
+            f.write(hashlib.blake2b(payload).digest())
+            f.write(payload)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # e.g. disk full mid-dump; don't leave the partial file around
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
-def paginate_words(words, words_per_page=20):
+    return result
+
+def count_pages(offsets, words_per_page=20):
+    """
+    Returns how many "pages" of up to words_per_page
+    words are needed to hold the words in offsets.
+    Pages are never materialized; page i covers words
+    i * words_per_page up to (i + 1) * words_per_page.
+    """
+    total_words = len(offsets) - 1
+    return (total_words + words_per_page - 1) // words_per_page
+
+def page_bounds(offsets, page_idx, words_per_page=20):
     """
-    Splits the list of words into "pages" each containing
-    up to words_per_page words.
-    Returns a list of lists.
+    Returns the (start, end) positions of the given page
+    in the full text, for slicing as full_text[start:end].
     """
-    pages = []
-    total_words = len(words)
-    idx = 0
-    while idx < total_words:
-        chunk = words[idx : idx + words_per_page]
-        pages.append(chunk)
-        idx += words_per_page
-    return pages
+    total_words = len(offsets) - 1
+    start = page_idx * words_per_page
+    end = min(start + words_per_page, total_words)
+    return offsets[start], offsets[end] - 1
 
 # -----------------------------------------------------
 # 2) A Simulated eInk Display Class
@@ -52,31 +247,60 @@ class EInkDisplaySim:
     In real usage, you would replace this class
     with your actual eInk display driver code.
     """
+    # Largest piece of text inserted per Tk callback
+    DRAW_CHUNK_CHARS = 4096
+
     def __init__(self, text_widget):
         self.text_widget = text_widget
+        self._draw_job = None  # Pending chunked insert, if any
     
     def clear(self):
         """Clears the simulated display."""
+        self._cancel_draw()
         self.text_widget.delete('1.0', tk.END)
     
     def draw_text(self, text):
         """
         Draw the given text in the Text widget.
+        Very large pages are inserted a chunk at a time
+        from timer callbacks so the GUI stays responsive.
         """
-        self.text_widget.insert(tk.END, text)
+        self._cancel_draw()
+        self._draw_chunk(text, 0)
+
+    def _draw_chunk(self, text, start):
+        end = start + self.DRAW_CHUNK_CHARS
+        self.text_widget.insert(tk.END, text[start:end])
+        if end < len(text):
+            # A timer rather than after_idle: refresh()'s
+            # update_idletasks() keeps running idle callbacks until
+            # none are left, so it would insert every chunk in one go.
+            self._draw_job = self.text_widget.after(1, self._draw_chunk, text, end)
+        else:
+            self._draw_job = None
+
+    def _cancel_draw(self):
+        if self._draw_job is not None:
+            self.text_widget.after_cancel(self._draw_job)
+            self._draw_job = None
     
     def refresh(self):
         """
         In a real eInk display, you'd trigger
         the actual hardware refresh here.
-        For simulation, we can just do nothing
-        or forcibly update the GUI.
+        For simulation, we flush pending redraws of the GUI.
+        Only idle tasks are run, not a full update(); bursts of
+        page turns are already coalesced by the reader's
+        debounced render.
         """
-        self.text_widget.update()
+        self.text_widget.update_idletasks()
 
 # -----------------------------------------------------
 # 3) The Main GUI Application
 # -----------------------------------------------------
+# Delay used to coalesce bursts of page renders
+RENDER_DEBOUNCE_MS = 5
+
 class EPubReaderGUI:
     def __init__(self, root):
         self.root = root
@@ -84,8 +308,16 @@ class EPubReaderGUI:
 
         # Default settings
         self.words_per_page = 20
-        self.pages = []  # List of pages (each page is a list of words)
+        # The book's words joined by single spaces, plus where each word
+        # starts (see extract_text_from_epub); pages are slices of it.
+        self.full_text = ''
+        self.offsets = array('I', [0])
         self.current_page_idx = 0
+        self._render_job = None  # Pending debounced render, if any
+
+        # Page strings, keyed by page index; cleared whenever
+        # the text or words-per-page setting change.
+        self._page_text = functools.lru_cache(maxsize=64)(self._slice_page)
 
         # -------------------------------------------------
         # Layout: top frame for buttons, main frame for "display"
@@ -143,11 +375,11 @@ class EPubReaderGUI:
             return  # User cancelled
 
         try:
-            all_words = extract_text_from_epub(file_path)
-            self.pages = paginate_words(all_words, self.words_per_page)
+            self.full_text, self.offsets = load_text_cached(file_path)
             self.current_page_idx = 0
+            self._page_text.cache_clear()
             
-            if not self.pages:
+            if not self.full_text:
                 messagebox.showwarning("Warning", "No textual content found in this ePub.")
                 return
             
@@ -157,9 +389,9 @@ class EPubReaderGUI:
 
     def next_page(self):
         """Navigates to the next page if possible."""
-        if not self.pages:
+        if not self.full_text:
             return  # No pages loaded
-        if self.current_page_idx < len(self.pages) - 1:
+        if self.current_page_idx < count_pages(self.offsets, self.words_per_page) - 1:
             self.current_page_idx += 1
             self.render_current_page()
         else:
@@ -167,7 +399,7 @@ class EPubReaderGUI:
 
     def prev_page(self):
         """Navigates to the previous page if possible."""
-        if not self.pages:
+        if not self.full_text:
             return
         if self.current_page_idx > 0:
             self.current_page_idx -= 1
@@ -177,10 +409,11 @@ class EPubReaderGUI:
 
     def set_words_per_page(self):
         """
-        Asks the user for a new words-per-page setting,
-        re-paginates, and resets to page 0.
+        Asks the user for a new words-per-page setting
+        and resets to page 0. Pages are sliced on demand,
+        so nothing needs to be re-paginated.
         """
-        if not self.pages:
+        if not self.full_text:
             messagebox.showinfo("Info", "Open an ePub first before setting words/page.")
             return
 
@@ -193,36 +426,56 @@ class EPubReaderGUI:
 
         if new_wpp is None:
             return  # user cancelled
-        # Re-paginate
-        # Flatten current pages back to a single word list:
-        all_words = [word for page in self.pages for word in page]
         self.words_per_page = new_wpp
-        self.pages = paginate_words(all_words, self.words_per_page)
         self.current_page_idx = 0
+        self._page_text.cache_clear()
         self.render_current_page()
 
     # -------------------------------------------------
     # Display logic
     # -------------------------------------------------
+    def _slice_page(self, page_idx):
+        """
+        Returns the given page's words as a single slice of the
+        book's text; no per-word joining is needed.
+        """
+        start, end = page_bounds(self.offsets, page_idx, self.words_per_page)
+        return self.full_text[start:end]
+
     def render_current_page(self):
+        """
+        Schedule a render of the current page. Requests made in
+        quick succession (e.g. rapid Next clicks) are coalesced
+        so only the last page is actually drawn.
+        """
+        if self._render_job is not None:
+            self.root.after_cancel(self._render_job)
+        self._render_job = self.root.after(RENDER_DEBOUNCE_MS, self._render_now)
+
+    def _render_now(self):
         """
         Render the current page's words to the eInk display simulation.
+        Runs from a Tk timer, outside the callers' error handling,
+        so failures are reported here.
         """
-        if not self.pages:
+        self._render_job = None
+        if not self.full_text:
             return
 
-        # Clear the simulated display
-        self.eink_display.clear()
+        try:
+            # Clear the simulated display
+            self.eink_display.clear()
 
-        # Prepare text to render
-        page_words = self.pages[self.current_page_idx]
-        text_to_display = " ".join(page_words)
+            # Prepare text to render (cached, so flipping back is free)
+            text_to_display = self._page_text(self.current_page_idx)
 
-        # Draw text
-        self.eink_display.draw_text(text_to_display)
+            # Draw text
+            self.eink_display.draw_text(text_to_display)
 
-        # Trigger refresh (simulated)
-        self.eink_display.refresh()
+            # Trigger refresh (simulated)
+            self.eink_display.refresh()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to render page:\n{e}")
 
 # -----------------------------------------------------
 # 4) Main Entry Point